@@ -19,11 +19,16 @@ MAX_SHIFTS_PER_DAY = 1
 # in ms
 SOLVE_TIME_LIMIT = 65_000
 
-SOLVER = 'CP-SAT'
-
-DEBUG = True
+# write the model out and log the solver search
+DEBUG = False
 
 RELATIVE_MIP_GAP = 0.01
 
+# hint the solver with the last solution of a model with the same hours and staff
+WARM_START = True
+
+# 'compact' (hourly variables) or 'pattern' (one variable per shift pattern)
+FORMULATION = 'pattern'
+
 # obj function weight for WDC
 W1 = 0.75
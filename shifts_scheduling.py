@@ -1,15 +1,32 @@
 import os
 import time
 import json
+from bisect import bisect_left, bisect_right
 from collections import defaultdict
-from typing import Dict, List
+from pathlib import Path
+from typing import Dict
 
+import numpy as np
 import pandas as pd
-from ortools.linear_solver import pywraplp
+from ortools.sat.python import cp_model
 
 from config import MIN_SHIFT_HOURS, MAX_SHIFT_HOURS, MIN_REST_HOURS, \
-    ROLE_OT_PROHIBITED, MIN_STAFF_PER_HOUR, SOLVE_TIME_LIMIT, SOLVER, DEBUG, \
-    MAX_DAYS_PER_WEEK, RELATIVE_MIP_GAP, MAX_SHIFTS_PER_DAY, W1
+    ROLE_OT_PROHIBITED, MIN_STAFF_PER_HOUR, SOLVE_TIME_LIMIT, DEBUG, \
+    MAX_DAYS_PER_WEEK, RELATIVE_MIP_GAP, MAX_SHIFTS_PER_DAY, W1, WARM_START, \
+    FORMULATION
+
+# CP-SAT needs integer objective coefficients, the weights are scaled to
+# this fixed precision
+OBJ_SCALE = 10 ** 6
+
+# time offsets used when building the constraints
+TD_HOUR = pd.Timedelta(hours=1)
+TD_BUS_EOD = pd.Timedelta(hours=23)
+TD_MIN_SHIFT = pd.Timedelta(hours=MIN_SHIFT_HOURS - 1)
+TD_MAX_SHIFT = pd.Timedelta(hours=MAX_SHIFT_HOURS - 1)
+TD_REST = pd.Timedelta(hours=MIN_SHIFT_HOURS + MIN_REST_HOURS - 1)
+TD_MIN_REST = pd.Timedelta(hours=MIN_REST_HOURS)
+TD_OT = pd.Timedelta(hours=MAX_SHIFT_HOURS - MIN_SHIFT_HOURS + 1)
 
 
 class Model:
@@ -26,244 +43,450 @@ class Model:
         demand_df['week'] = (
             (demand_df['date_time'] - demand_df['date_time'].min()).dt.days // 7) + 1
 
+        # hours are sorted, so that the hour index j follows the date-time order
+        demand_df = demand_df.sort_values('date_time', ignore_index=True)
+
         self.M = len(staff_df)
         self.demand_dict = demand_df.set_index('date_time')['demand'].to_dict()
         self.demand_df = demand_df
+
+        # variables are indexed by the position j of the hour in dts_list,
+        # sorted_ns (int64 nanoseconds) is used to slice subsets of hours by
+        # binary search
+        self.dts_list = list(self.demand_dict)
+        self.H = len(self.dts_list)
+        self.sorted_ns = np.array(self.dts_list, dtype='datetime64[ns]') \
+            .astype('int64').tolist()
+        self.dt_index = {dt: j for j, dt in enumerate(self.dts_list)}
+
+        # column arrays, indexed by position in the loops below
+        self.demands = [self.demand_dict[dt] for dt in self.dts_list]
+        # upper bound of the shortfall y, the former y1 (at most 1) + y2 bounds,
+        # so that MIN_STAFF_PER_HOUR raises the minimum staff working any hour
+        min_staff = min(self.M, MIN_STAFF_PER_HOUR - 1)
+        self.max_short = [min(d, 1 + max(0, d - min_staff)) for d in self.demands]
+        self.bus_days = demand_df['bus_day'].to_numpy()
+        self.unique_bus_days = list(pd.unique(demand_df['bus_day']))
+        self.day_to_idx = defaultdict(list)
+        for j, bus_day in enumerate(self.bus_days):
+            self.day_to_idx[bus_day].append(j)
+        self.week_to_days = {
+            w: [pd.Timestamp(d) for d in
+                pd.unique(demand_df.loc[demand_df['week'] == w, 'bus_day'])]
+            for w in demand_df['week'].unique()
+        }
+        self.roles = staff_df['role'].to_numpy()
+        self.wages = staff_df['hourly_wage'].to_numpy()
+        self.ot_wages = staff_df['overtime_hourly_wage'].to_numpy()
+        self.staff_ids = staff_df['staff_id'].astype(str).to_numpy()
         self.staff_df = staff_df
 
-    def schedule_shifts(self, timeout=SOLVE_TIME_LIMIT) -> Dict:
+        # masks for the variable bounds
+        # too_late_mask: a shift starting at this hour would end after the business day
+        # is_early_hour: hour is within the first MIN_SHIFT_HOURS of the day
+        # role_prohibits_ot: staff role can't work overtime
+        dts_arr = demand_df['date_time'].to_numpy()
+        self.too_late_mask = (
+            (dts_arr + np.timedelta64(MIN_SHIFT_HOURS, 'h')).astype('datetime64[D]')
+            > self.bus_days.astype('datetime64[D]'))
+        self.is_early_hour = demand_df['date_time'].dt.hour.to_numpy() < MIN_SHIFT_HOURS
+        self.role_prohibits_ot = np.isin(self.roles, ROLE_OT_PROHIBITED)
+
+        # shift starts of the last solve, reused as hints by compatible models
+        # (same hours and same staff)
+        self.cache_key = (tuple(self.dts_list), tuple(self.staff_ids))
+        self._last_solution: Dict = {}
+
+    def schedule_shifts(self, timeout=SOLVE_TIME_LIMIT,
+                        warm_start_from=None,
+                        formulation=FORMULATION,
+                        debug=DEBUG,
+                        mip_gap=None) -> Dict:
         '''
         Schedule Shifts main function
         Returns metrics and a CSV with the optimised schedule
-        '''
 
-        # Create the solver
-        solver = pywraplp.Solver.CreateSolver(SOLVER)
+        warm_start_from: a previously solved Model, its shift starts are used
+        as solution hints if it has the same hours and staff.
+        Defaults to this model's own last solve.
+
+        formulation: 'compact' (hourly variables) or 'pattern'
+        (one variable per feasible shift pattern, see add_pattern_variables)
 
-        if not solver:
-            print('Solver not created.')
-            raise ValueError('Solver could not be created')
+        debug: write the model to output/model.pb.txt and log the search
 
-        # Dictionaries for decision variables
-        x_start = defaultdict(dict)
-        x = defaultdict(dict)
-        x_ot = defaultdict(dict)
+        mip_gap: relative gap at which the solver stops,
+        defaults to RELATIVE_MIP_GAP
+        '''
+
+        if formulation not in ('compact', 'pattern'):
+            raise ValueError(f'Unknown formulation: {formulation}')
+        if mip_gap is None:
+            mip_gap = RELATIVE_MIP_GAP
+        if mip_gap < 0:
+            raise ValueError(f'MIP gap must be non-negative: {mip_gap}')
+
+        # Create the model
+        model = cp_model.CpModel()
+
+        # Decision variables
+        # hourly variables are plain lists indexed by [i][j], so that the
+        # constraint windows can be sliced
+        x_start = [[None] * self.H for _ in range(self.M)]
+        x = [[None] * self.H for _ in range(self.M)]
+        x_ot = [[None] * self.H for _ in range(self.M)]
         x_day = defaultdict(dict)
-        y1 = {}
-        y2 = {}
+        y = [None] * self.H
+
+        if formulation == 'pattern':
+            x_shift = defaultdict(dict)
+            self.add_pattern_variables(
+                model, x_shift, x_start, x, x_ot, y, x_day)
+            self.add_pattern_constraints(
+                model, x_shift, x, y, x_day)
+        else:
+            self.add_variables(model, x_start, x, x_ot, y, x_day)
+            self.add_constraints(model, x_start, x, x_ot, y, x_day)
 
-        self.add_variables(solver, x_start, x, x_ot, y1, y2, x_day)
-        self.add_constraints(solver, x_start, x, x_ot, y1, y2, x_day)
+        # hint shift starts from a previous solution
+        previous = warm_start_from if warm_start_from is not None else self
+        if WARM_START and previous.cache_key == self.cache_key:
+            for (i, j), value in previous._last_solution.items():
+                model.AddHint(x_start[i][j], value)
 
         # --
         # Objective function:
         # Maximise (AVG) Demand Coverage (scheduled hours/ demand per hour)
         # and Minimise the Ratio of OT hours to scheduled hours
         #  --> minimise number of staff short (y) + number of over time hours (x_ot)
-        solver.Minimize(
-            sum(
-                (W1*(y1[dt]+2*y2[dt]) + (1-W1)*sum(x_ot[i][dt]
-                 for i in range(self.M))) / self.demand_dict[dt]
-                for dt in self.demand_dict if self.demand_dict[dt]
-            )
-        )
-
-        metrics = self.solve(solver, x_start, x, x_ot, timeout)
+        # the weights W1/demand and (1-W1)/demand are scaled to OBJ_SCALE
+        obj_vars, obj_coeffs = [], []
+        for j, d in enumerate(self.demands):
+            if not d:
+                continue
+            obj_vars += [y[j]] + [x_ot[i][j] for i in range(self.M)]
+            obj_coeffs += [round(W1 / d * OBJ_SCALE)] \
+                + [round((1 - W1) / d * OBJ_SCALE)] * self.M
+        model.Minimize(cp_model.LinearExpr.WeightedSum(obj_vars, obj_coeffs))
+
+        metrics = self.solve(model, x_start, x, x_ot, timeout, debug, mip_gap)
         return metrics
 
     def add_variables(
-            self, solver,
-            x_start, x, x_ot, y1, y2, x_day
+            self, model,
+            x_start, x, x_ot, y, x_day
     ) -> None:
         '''
         Add variables to model
         '''
 
         for i in range(self.M):
-            for j, dt in enumerate(self.demand_df['date_time']):
+            for j, dt in enumerate(self.dts_list):
 
                 # Variable >> x_start = 1 if staff i starts shift at dt
-                x_start[i][dt] = solver.IntVar(0, 1, f'x_start{i}_{j}')
                 #  shift must end in the same business day
-                if pd.to_datetime((dt + pd.Timedelta(hours=MIN_SHIFT_HOURS))).date() > self.demand_df.iloc[j]['bus_day']:
-                    x_start[i][dt].SetBounds(0, 0)
+                if self.too_late_mask[j]:
+                    x_start[i][j] = model.NewIntVar(0, 0, f'x_start{i}_{j}')
+                else:
+                    x_start[i][j] = model.NewBoolVar(f'x_start{i}_{j}')
 
                 # Variable >>  x = 1 if staff i is working during dt
-                x[i][dt] = solver.BoolVar(f'x{i}_{j}')
+                x[i][j] = model.NewBoolVar(f'x{i}_{j}')
 
                 # Variable >>  x_ot = 1 if staff i is working overtime during dt
-                x_ot[i][dt] = solver.NumVar(0, 1, f'x_ot{i}_{j}')
-
                 # set bounds of x_ot:
                 # ex, Staff with “Branch Manager” roles cannot work overtime hours
                 # can't work overtime in the first MIN_SHIFT_HOURS of the day
-                if self.staff_df.iloc[i]['role'] in ROLE_OT_PROHIBITED \
-                        or dt.hour < MIN_SHIFT_HOURS:
-                    x_ot[i][dt].SetBounds(0, 0)
+                if self.role_prohibits_ot[i] or self.is_early_hour[j]:
+                    x_ot[i][j] = model.NewIntVar(0, 0, f'x_ot{i}_{j}')
+                else:
+                    x_ot[i][j] = model.NewBoolVar(f'x_ot{i}_{j}')
 
                 # last staff member
                 if i == (self.M - 1):
                     # Variable >>  y = number of staff short in hour dt
-                    #  y1 at most 1 staff, y2 more than 1 staff
-                    y1[dt] = solver.IntVar(
-                        0,
-                        1,
-                        f'y1_{j}'
-                    )
-
-                    y2[dt] = solver.IntVar(
-                        0,
-                        max(0, self.demand_dict[dt] -
-                            min(self.M, MIN_STAFF_PER_HOUR-1)),
-                        f'y2_{j}'
-                    )
+                    y[j] = model.NewIntVar(0, self.max_short[j], f'y_{j}')
             # create a variable for each unique business day
             # x_day = 1 if staff i is working during some hours on this business day
-            for d, bus_day in enumerate(self.demand_df['bus_day'].unique().tolist()):
-                x_day[i][pd.to_datetime(bus_day)] = solver.BoolVar(
+            for d, bus_day in enumerate(self.unique_bus_days):
+                x_day[i][pd.to_datetime(bus_day)] = model.NewBoolVar(
                     f'x_day{i}_{d}')
-                x_day[i][pd.to_datetime(bus_day)].SetBranchingPriority(1)
 
     def add_constraints(
-            self, solver,
-            x_start, x, x_ot, y1, y2, x_day
+            self, model,
+            x_start, x, x_ot, y, x_day
     ) -> None:
         '''
         Builds all the constraints and adds to the model
         '''
 
-        for i in range(self.M):
-
-            last_seen_date = None
+        # the hour windows don't depend on the staff, so they are computed once
+        windows = [self.get_hour_windows(j) for j in range(self.H)]
 
-            for j, dt in enumerate(self.demand_dict):
+        for i in range(self.M):
 
-                bus_day = pd.to_datetime(self.demand_df.iloc[j]['bus_day'])
-                bus_eod = pd.to_datetime(bus_day + pd.Timedelta(hours=23))
+            for j, (past, rest, shift, potential_overtime_idx,
+                    additional_rest_idx, previous_idx) in enumerate(windows):
 
                 # Constraint >> If x=1, then x_start must be 1 in the past 12 hours
                 # to link x_start with x
-                past_dts = self.get_subset_dts(
-                    min_dt=max(bus_day, dt -
-                               pd.Timedelta(hours=MAX_SHIFT_HOURS - 1)),
-                    max_dt=dt,
-                    max_length=MAX_SHIFT_HOURS
-                )
-                solver.Add(
-                    x[i][dt] <= sum(x_start[i][p_dt] for p_dt in past_dts),
-                    name=f"past{i}_{j}"
-                )
+                model.Add(
+                    x[i][j] <= cp_model.LinearExpr.Sum(x_start[i][past])
+                ).WithName(f"past{i}_{j}")
 
                 # Constraint >> rest based on regular shift
                 # x_start = 0 for next MIN_SHIFT_HOURS + MIN_REST_HOURS if x_start = 0 in dt
                 # satisfies: the same staff must rest (not work a shift) for at least 4hrs
                 # between any two consecutive shifts
-                rest_dts = self.get_subset_dts(
-                    min_dt=dt + pd.Timedelta(hours=1),
-                    max_dt=dt +
-                    pd.Timedelta(hours=MIN_SHIFT_HOURS + MIN_REST_HOURS - 1),
-                    max_length=MIN_SHIFT_HOURS + MIN_REST_HOURS - 1
-                )
-                solver.Add(
-                    sum(x_start[i][rest_dt] for rest_dt in rest_dts) <= len(
-                        rest_dts) * (1 - x_start[i][dt]),
-                    name=f"rest{i}_{j}"
-                )
+                # sum(x_start[rest]) + len(rest) * x_start[j] <= len(rest)
+                rest_starts = x_start[i][rest]
+                model.Add(
+                    cp_model.LinearExpr.WeightedSum(
+                        rest_starts + [x_start[i][j]],
+                        [1] * len(rest_starts) + [len(rest_starts)]
+                    ) <= len(rest_starts)
+                ).WithName(f"rest{i}_{j}")
 
                 # Constraint >> Each shift must last at least 9hrs
-                shift_dts = self.get_subset_dts(
-                    min_dt=dt,
-                    max_dt=dt + pd.Timedelta(hours=MIN_SHIFT_HOURS - 1),
-                    max_length=MIN_SHIFT_HOURS
-                )
-                solver.Add(
-                    sum(x[i][s_dt] for s_dt in shift_dts) >= len(
-                        shift_dts) * x_start[i][dt],
-                    name=f"min_shift{i}_{j}"
-                )
+                # sum(x[shift]) - len(shift) * x_start[j] >= 0
+                shift_works = x[i][shift]
+                model.Add(
+                    cp_model.LinearExpr.WeightedSum(
+                        shift_works + [x_start[i][j]],
+                        [1] * len(shift_works) + [-len(shift_works)]
+                    ) >= 0
+                ).WithName(f"min_shift{i}_{j}")
 
                 # loop over potential overtime hours
-                potential_overtime_dts = self.get_subset_dts(
-                    min_dt=max(shift_dts) + pd.Timedelta(hours=1),
-                    max_dt=min(bus_eod, max(
-                        shift_dts) + pd.Timedelta(hours=MAX_SHIFT_HOURS - MIN_SHIFT_HOURS + 1)),
-                    max_length=MAX_SHIFT_HOURS - MIN_SHIFT_HOURS + 1
-                )
-                additional_rest_dts = self.get_subset_dts(
-                    min_dt=max(rest_dts) + pd.Timedelta(hours=1),
-                    max_dt=max(rest_dts) + pd.Timedelta(hours=MIN_REST_HOURS),
-                    max_length=MIN_REST_HOURS
-                ) if len(rest_dts) else []
-
-                for o, overtime_dt in enumerate(potential_overtime_dts):
+                for o, ot in enumerate(potential_overtime_idx):
                     # Constraint >> ensure consecutive hours are scheduled
-                    solver.Add(
-                        1 + x[i][overtime_dt + pd.Timedelta(hours=-1)]
-                        >= x_start[i][dt] + x[i][overtime_dt],
-                        name=f"consecutive{i}_{j}_o{o}"
-                    )
+                    model.Add(
+                        1 + x[i][previous_idx[o]]
+                        >= x_start[i][j] + x[i][ot]
+                    ).WithName(f"consecutive{i}_{j}_o{o}")
                     # Constraint >> set overtime hours
-                    solver.Add(
-                        1 + x_ot[i][overtime_dt]
-                        >= x_start[i][dt] + x[i][overtime_dt],
-                        name=f"ot{i}_{j}_o{o}"
-                    )
+                    model.Add(
+                        1 + x_ot[i][ot]
+                        >= x_start[i][j] + x[i][ot]
+                    ).WithName(f"ot{i}_{j}_o{o}")
                     # Constraint >> set an additional rest hour if OT is used
-                    if len(additional_rest_dts) >= (o + 1):
-                        solver.Add(
-                            1 - x_ot[i][overtime_dt]
-                            >= x_start[i][additional_rest_dts[o]],
-                            name=f"rest{i}_{j}_o{o}"
-                        )
-
-                # Constraint >> A staff member can only work 1 shift per business day
-                other_starts = self.get_subset_dts(
-                    min_dt=bus_day,
-                    max_dt=bus_eod
-                )
-                solver.Add(
-                    sum(x_start[i][o_start]
-                        for o_start in other_starts) <= MAX_SHIFTS_PER_DAY,
-                    name=f"max_per_day{i}_{j}"
-                )
+                    if len(additional_rest_idx) >= (o + 1):
+                        model.Add(
+                            1 - x_ot[i][ot]
+                            >= x_start[i][additional_rest_idx[o]]
+                        ).WithName(f"rest{i}_{j}_o{o}")
+
+            # Constraint >> A staff member can only work 1 shift per business day
+            for d, bus_day in enumerate(self.unique_bus_days):
+                model.Add(
+                    cp_model.LinearExpr.Sum(
+                        [x_start[i][o_start] for o_start in self.day_to_idx[bus_day]]
+                    ) <= MAX_SHIFTS_PER_DAY
+                ).WithName(f"max_per_day{i}_{d}")
+
+            # Constraint >> link x with x_day (per day)
+            if len(self.unique_bus_days) > MAX_DAYS_PER_WEEK:
+                for d, bus_day in enumerate(self.unique_bus_days):
+                    day_idx = self.day_to_idx[bus_day]
+                    model.Add(
+                        cp_model.LinearExpr.WeightedSum(
+                            [x[i][d_j] for d_j in day_idx]
+                            + [x_day[i][pd.Timestamp(bus_day)]],
+                            [1] * len(day_idx) + [-len(day_idx)]
+                        ) <= 0
+                    ).WithName(f"day_link{i}_{d}")
 
-                # Constraint >> link x with x_day (per day)
-                if bus_day != last_seen_date and len(self.demand_df['bus_day'].unique()) > MAX_DAYS_PER_WEEK:
-                    day_dts = self.get_subset_dts(
-                        min_dt=bus_day,
-                        max_dt=bus_eod
-                    )
-                    solver.Add(
-                        sum(x[i][d_dt] for d_dt in day_dts) <= len(
-                            day_dts) * x_day[i][bus_day],
-                        name=f"day_link{i}_{j}"
+            # Constraint >>: Each staff member must have exactly 1 day-off per week
+            for w, week_days in self.week_to_days.items():
+                if len(week_days) > MAX_DAYS_PER_WEEK:
+                    model.Add(
+                        cp_model.LinearExpr.Sum(
+                            [x_day[i][w_d] for w_d in week_days]
+                        ) <= MAX_DAYS_PER_WEEK
+                    ).WithName(f"max_per_week{i}_{w}")
+
+        self.add_coverage_constraints(model, x, y)
+
+    def get_hour_windows(self, j) -> tuple:
+        '''
+        Index windows used by the constraints of the compact model at hour j,
+        the past, rest and shift windows are returned as slices
+        '''
+        dt = self.dts_list[j]
+        bus_day = pd.Timestamp(self.bus_days[j])
+        bus_eod = bus_day + TD_BUS_EOD
+
+        past_idx = self.get_subset_idx(
+            min_dt=max(bus_day, dt - TD_MAX_SHIFT),
+            max_dt=dt,
+            max_length=MAX_SHIFT_HOURS
+        )
+        rest_idx = self.get_subset_idx(
+            min_dt=dt + TD_HOUR,
+            max_dt=dt + TD_REST,
+            max_length=MIN_SHIFT_HOURS + MIN_REST_HOURS - 1
+        )
+        shift_idx = self.get_subset_idx(
+            min_dt=dt,
+            max_dt=dt + TD_MIN_SHIFT,
+            max_length=MIN_SHIFT_HOURS
+        )
+        shift_end = self.dts_list[shift_idx[-1]]
+        potential_overtime_idx = self.get_subset_idx(
+            min_dt=shift_end + TD_HOUR,
+            max_dt=min(bus_eod, shift_end + TD_OT),
+            max_length=MAX_SHIFT_HOURS - MIN_SHIFT_HOURS + 1
+        )
+        rest_end = self.dts_list[rest_idx[-1]] if len(rest_idx) else None
+        additional_rest_idx = self.get_subset_idx(
+            min_dt=rest_end + TD_HOUR,
+            max_dt=rest_end + TD_MIN_REST,
+            max_length=MIN_REST_HOURS
+        ) if len(rest_idx) else []
+        # hour before each potential overtime hour
+        previous_idx = [self.dt_index[self.dts_list[ot] - TD_HOUR]
+                        for ot in potential_overtime_idx]
+
+        return (slice(past_idx.start, past_idx.stop),
+                slice(rest_idx.start, rest_idx.stop),
+                slice(shift_idx.start, shift_idx.stop),
+                potential_overtime_idx, additional_rest_idx, previous_idx)
+
+    def add_coverage_constraints(
+            self, model, x, y
+    ) -> None:
+        '''
+        Adds the demand coverage constraints, shared by both formulations
+        '''
+
+        # Constraint >>: to check demand coverage DC
+        # satisfies: At any given hour, there must be at least 2 staff members
+        # working a shift at the branch
+        for j in range(self.H):
+            model.Add(
+                cp_model.LinearExpr.Sum(
+                    [x[s][j] for s in range(self.M)] + [y[j]]
+                ) >= self.demands[j]
+            ).WithName(f"dc{j}")
+
+    def add_pattern_variables(
+            self, model,
+            x_shift, x_start, x, x_ot, y, x_day
+    ) -> None:
+        '''
+        Add variables to the set-partitioning model
+        Each column is a feasible shift pattern for a staff member,
+        x_shift = 1 if staff i works a shift of `length` hours starting at hour j.
+        x_start, x and x_ot are the sums of the patterns starting, working
+        and in overtime at hour j, so solve() reads them as in the compact model
+        '''
+
+        for i in range(self.M):
+            # Staff with “Branch Manager” roles cannot work overtime hours
+            lengths = [MIN_SHIFT_HOURS] if self.role_prohibits_ot[i] \
+                else range(MIN_SHIFT_HOURS, MAX_SHIFT_HOURS + 1)
+
+            starts = defaultdict(list)
+            works = defaultdict(list)
+            overtime = defaultdict(list)
+
+            for j, dt in enumerate(self.dts_list):
+                bus_eod = pd.Timestamp(self.bus_days[j]) + TD_BUS_EOD
+
+                #  shift must end in the same business day
+                if self.too_late_mask[j]:
+                    continue
+
+                for length in lengths:
+                    shift_idx = self.get_subset_idx(
+                        min_dt=dt,
+                        max_dt=dt + TD_HOUR * (length - 1),
+                        max_length=MAX_SHIFT_HOURS
                     )
-                    last_seen_date = bus_day
+                    # overtime can't go past the end of the business day
+                    if len(shift_idx) < length or self.dts_list[shift_idx[-1]] > bus_eod:
+                        break
+
+                    x_shift[i][(j, length)] = model.NewBoolVar(
+                        f'x_shift{i}_{j}_{length}')
+                    starts[j].append(x_shift[i][(j, length)])
+                    for h, s in enumerate(shift_idx):
+                        works[s].append(x_shift[i][(j, length)])
+                        if h >= MIN_SHIFT_HOURS:
+                            overtime[s].append(x_shift[i][(j, length)])
+
+            for j in range(self.H):
+                # Variable >> x_start = 1 if staff i starts shift at dt
+                x_start[i][j] = model.NewBoolVar(f'x_start{i}_{j}')
+                model.Add(x_start[i][j] == cp_model.LinearExpr.Sum(starts[j]))
+
+                x[i][j] = cp_model.LinearExpr.Sum(works[j])
+                x_ot[i][j] = cp_model.LinearExpr.Sum(overtime[j])
 
-                # last staff
+                # last staff member
                 if i == (self.M - 1):
-                    # Constraint >>: to check demand coverage DC
-                    # satisfies: At any given hour, there must be at least 2 staff members
-                    # working a shift at the branch
-                    solver.Add(
-                        sum(x[s][dt] for s in range(self.M)) +
-                        y1[dt] + y2[dt] >= self.demand_dict[dt],
-                        name=f"dc{j}"
-                    )
+                    y[j] = model.NewIntVar(0, self.max_short[j], f'y_{j}')
 
-            # Constraint >>: Each staff member must have exactly 1 day-off per week
-            for w in self.demand_df['week'].unique().tolist():
-                week_days = self.demand_df.loc[self.demand_df['week'] == w]['bus_day'].unique(
+            for d, bus_day in enumerate(self.unique_bus_days):
+                x_day[i][pd.to_datetime(bus_day)] = model.NewBoolVar(
+                    f'x_day{i}_{d}')
+
+    def add_pattern_constraints(
+            self, model,
+            x_shift, x, y, x_day
+    ) -> None:
+        '''
+        Builds the constraints of the set-partitioning model
+        '''
+
+        for i in range(self.M):
+
+            # Constraint >> rest between shifts
+            # a shift blocks any other start until MIN_REST_HOURS after it ends,
+            # so at most one pattern can block each start hour
+            blocking = defaultdict(list)
+            per_day = defaultdict(list)
+            for (j, length), var in x_shift[i].items():
+                dt = self.dts_list[j]
+                blocked_idx = self.get_subset_idx(
+                    min_dt=dt,
+                    max_dt=dt + TD_HOUR * (length + MIN_REST_HOURS - 1)
                 )
+                for b in blocked_idx:
+                    blocking[b].append(var)
+                per_day[pd.Timestamp(self.bus_days[j])].append(var)
+
+            for (j, length) in x_shift[i]:
+                if len(blocking[j]) > 1:
+                    model.AddAtMostOne(blocking[j])
+
+            # Constraint >> A staff member can only work 1 shift per business day
+            # and link the shifts with x_day (per day)
+            for bus_day, day_shifts in per_day.items():
+                if len(self.unique_bus_days) > MAX_DAYS_PER_WEEK:
+                    model.Add(
+                        cp_model.LinearExpr.Sum(day_shifts)
+                        <= MAX_SHIFTS_PER_DAY * x_day[i][bus_day]
+                    ).WithName(f"max_per_day{i}_{bus_day.date()}")
+                else:
+                    model.Add(
+                        cp_model.LinearExpr.Sum(day_shifts) <= MAX_SHIFTS_PER_DAY
+                    ).WithName(f"max_per_day{i}_{bus_day.date()}")
+
+            # Constraint >>: Each staff member must have exactly 1 day-off per week
+            for w, week_days in self.week_to_days.items():
                 if len(week_days) > MAX_DAYS_PER_WEEK:
-                    solver.Add(
-                        sum(x_day[i][pd.to_datetime(w_d)]
-                            for w_d in week_days) <= MAX_DAYS_PER_WEEK,
-                        name=f"max_per_week{i}_{w}"
-                    )
+                    model.Add(
+                        cp_model.LinearExpr.Sum(
+                            [x_day[i][w_d] for w_d in week_days]
+                        ) <= MAX_DAYS_PER_WEEK
+                    ).WithName(f"max_per_week{i}_{w}")
+
+        self.add_coverage_constraints(model, x, y)
 
     def solve(
-            self, solver, x_start, x, x_ot, timeout
+            self, model, x_start, x, x_ot, timeout, debug=DEBUG,
+            mip_gap=RELATIVE_MIP_GAP
     ) -> Dict:
         '''
         Solve the problem and returns solution
@@ -284,20 +507,21 @@ class Model:
         WOR = sum(OH for all staff across the week) / sum(SH for all staff across the week)
         '''
 
+        solver = cp_model.CpSolver()
+
+        output_dir = Path("output")
+        output_dir.mkdir(exist_ok=True)
         # write problem out for debugging
-        if DEBUG:
-            with open(os.path.join("output", "model.lp"), "w") as f:
-                f.write(solver.ExportModelAsLpFormat(obfuscated=False))
-            solver.EnableOutput()
+        if debug:
+            model.ExportToFile(str(output_dir / "model.pb.txt"))
+            solver.parameters.log_search_progress = True
 
         start_timer = time.perf_counter()
-        solver.set_time_limit(timeout)
-        solver.SetNumThreads(8)
-
-        # note: this is being ignored for some reason
-        solver.RELATIVE_MIP_GAP = RELATIVE_MIP_GAP
+        solver.parameters.max_time_in_seconds = timeout / 1000
+        solver.parameters.num_workers = 8
+        solver.parameters.relative_gap_limit = mip_gap
 
-        status = solver.Solve()
+        status = solver.Solve(model)
         print('Solve time:',
               round(time.perf_counter() - start_timer, 2))
 
@@ -305,86 +529,96 @@ class Model:
         # Check the result
         columns = ['staff_id', 'start_date_time', 'end_date_time']
         rows = []
-        demand_coverage = defaultdict(float)
+        csv_file = None
+        wdc = 0
         total_cost = 0
+        total_sh = 0
+        total_ot = 0
+
+        if status in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+
+            print("status", solver.StatusName(status).lower())
+
+            # solution values as (staff x hour) arrays, hours in sorted order
+            x_start_val = np.array([[solver.Value(x_start[i][j]) for j in range(self.H)]
+                                    for i in range(self.M)])
+            x_val = np.array([[solver.Value(x[i][j]) for j in range(self.H)]
+                              for i in range(self.M)])
+            x_ot_val = np.array([[solver.Value(x_ot[i][j]) for j in range(self.H)]
+                                 for i in range(self.M)])
+
+            total_cost = np.maximum(x_val * self.wages[:, None],
+                                    x_ot_val * self.ot_wages[:, None]).sum()
+            total_sh = x_val.sum()
+            total_ot = x_ot_val.sum()
+
+            # demand coverage per hour, 0 for hours without demand
+            demand_arr = np.array(self.demands, dtype=float)
+            coverage = np.divide(x_val.sum(axis=0), demand_arr,
+                                 out=np.zeros_like(demand_arr), where=demand_arr > 0)
+            wdc = coverage.mean() if len(coverage) else 0
+
+            for i, j in zip(*np.nonzero(x_start_val)):
+                # start of a shift
+                dt = self.dts_list[j]
+                shift_idx = self.get_subset_idx(
+                    min_dt=dt,
+                    max_dt=dt + TD_MAX_SHIFT,
+                    max_length=MAX_SHIFT_HOURS
+                )
+                end_dt = self.dts_list[max([s for s in shift_idx if x_val[i, s] == 1])] \
+                    + TD_HOUR
+                rows.append(
+                    {
+                        'staff_id': self.staff_ids[i],
+                        'start_date_time': str(dt),
+                        'end_date_time': str(end_dt)
+                    }
+                )
 
-        if status in (pywraplp.Solver.OPTIMAL, pywraplp.Solver.FEASIBLE):
-
-            print("status",
-                  "optimal" if status == pywraplp.Solver.OPTIMAL else "feasible")
-
-            for i in range(self.M):
-                wage = self.staff_df.iloc[i]['hourly_wage']
-                ot_wage = self.staff_df.iloc[i]['overtime_hourly_wage']
-
-                for dt in self.demand_dict:
-
-                    total_cost += max(wage * x[i][dt].solution_value(),
-                                      ot_wage * x_ot[i][dt].solution_value())
-
-                    # start of a shift
-                    if x_start[i][dt].solution_value():
-                        shift_dts = self.get_subset_dts(
-                            min_dt=dt,
-                            max_dt=dt +
-                            pd.Timedelta(hours=MAX_SHIFT_HOURS - 1),
-                            max_length=MAX_SHIFT_HOURS
-                        )
-                        end_dt = max([_dt for _dt in shift_dts if x[i][_dt].solution_value() == 1]) \
-                            + pd.Timedelta(hours=1)
-                        rows.append(
-                            {
-                                'staff_id': str(self.staff_df.iloc[i]['staff_id']),
-                                'start_date_time': str(dt),
-                                'end_date_time': str(end_dt)
-                            }
-                        )
-
-                    demand_coverage[dt] += x[i][dt].solution_value() / self.demand_dict[dt] \
-                        if self.demand_dict[dt] else 0
+            self._last_solution = {
+                (i, j): int(x_start_val[i, j])
+                for i in range(self.M) for j in range(self.H)
+            }
+
+            # write csv
+            csv_file = str(output_dir / "shift.csv")
+            pd.DataFrame(rows, columns=columns).to_csv(csv_file, index=False)
 
         else:
             print('The problem does not have an optimal solution.')
 
-        # write csv
-        os.system("mkdir -p output")
-        csv_file = os.path.join("output", "shift.csv")
-        pd.DataFrame(rows, columns=columns).to_csv(csv_file)
-
-        total_sh = sum(x[i][dt].solution_value()
-                       for i in range(self.M) for dt in self.demand_dict)
         metrics = {
             'csv_file': csv_file,
-            'WDC': round(sum(demand_coverage.values()) / len(demand_coverage), 4) if demand_coverage else 0,
-            'WOR': round(sum(x_ot[i][dt].solution_value() for i in range(self.M) for dt in self.demand_dict)
-                         / total_sh, 4) if total_sh else 0
-            if demand_coverage else 0,
+            'WDC': round(float(wdc), 4),
+            'WOR': round(float(total_ot / total_sh), 4) if total_sh else 0,
             'total_cost': round(float(total_cost), 2),
-            'solver_status': "optimal" if status == pywraplp.Solver.OPTIMAL else "feasible",
+            'solver_status': solver.StatusName(status).lower(),
             'shifts': rows
         }
 
         # write metrics as json
-        json_file = os.path.join("output", "metrics.json")
-        with open(json_file, "w") as f:
-            json.dump(metrics, f, indent=4)
+        if csv_file:
+            json_file = output_dir / "metrics.json"
+            with open(json_file, "w", buffering=1 << 20) as f:
+                json.dump(metrics, f)
 
         return metrics
 
-    def get_subset_dts(
+    def get_subset_idx(
             self, min_dt, max_dt,
             max_length=None
-    ) -> List:
+    ) -> range:
         '''
-        Utility function to subset date-times based on the min/max datetime
+        Utility function to subset the hour indices based on the min/max datetime
         '''
-        subset_dts = [
-            _dt for _dt in self.demand_dict if min_dt <= _dt <= max_dt]
+        lo = bisect_left(self.sorted_ns, min_dt.value)
+        hi = bisect_right(self.sorted_ns, max_dt.value)
 
         # check length of subset
         if max_length:
-            assert len(subset_dts) <= max_length
-        return subset_dts
+            assert hi - lo <= max_length
+        return range(lo, hi)
 
 
 if __name__ == '__main__':
@@ -1,7 +1,10 @@
 import unittest
+from unittest import mock
 
 import pandas as pd
-from config import MIN_SHIFT_HOURS, MAX_SHIFT_HOURS, MAX_DAYS_PER_WEEK
+from ortools.sat.python import cp_model
+from config import MIN_SHIFT_HOURS, MAX_SHIFT_HOURS, MAX_DAYS_PER_WEEK, \
+    SOLVE_TIME_LIMIT
 from shifts_scheduling import Model
 
 
@@ -9,6 +12,11 @@ class TestSolution(unittest.TestCase):
 
     def setUp(self) -> None:
 
+        # expected values are the optimal schedules, so solve without a gap
+        patcher = mock.patch('shifts_scheduling.RELATIVE_MIP_GAP', 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
         self.wage = 9.63
         self.ot_wage = 14.44
         self.staff_df = pd.DataFrame(
@@ -20,6 +28,22 @@ class TestSolution(unittest.TestCase):
             ]
         )
 
+    @staticmethod
+    def spy_solve():
+        '''
+        Wraps CpSolver.Solve to inspect the solver and model it is called with
+        '''
+        return mock.patch.object(cp_model.CpSolver, 'Solve', autospec=True,
+                                 side_effect=cp_model.CpSolver.Solve)
+
+    @staticmethod
+    def num_hints(solve):
+        '''
+        Number of solution hints in the model passed to the last solve
+        '''
+        solver, model = solve.call_args[0]
+        return len(model.Proto().solution_hint.vars)
+
     def test_simple(self):
         '''
 	    one day, one staff, no OT
@@ -163,3 +187,233 @@ class TestSolution(unittest.TestCase):
 
             self.assertEqual((end_dt - start_dt).total_seconds() / 3600,
                              MAX_SHIFT_HOURS)
+
+    def test_warm_start(self):
+        '''
+	    2 days, one staff, hinted with a previous solution
+        '''
+
+        staff_df = self.staff_df
+        demand_df = pd.DataFrame(
+            [
+                {
+                    'date_time': pd.to_datetime('2025-01-01') + pd.Timedelta(hours=h),
+                    'demand': 3
+                }
+                for h in range(48)
+            ]
+        )
+
+        model = Model(demand_df.copy(), staff_df)
+        results = model.schedule_shifts()
+        self.assertTrue(model._last_solution)
+
+        warm_model = Model(demand_df.copy(), staff_df)
+        self.assertEqual(warm_model.cache_key, model.cache_key)
+        with self.spy_solve() as solve:
+            warm_results = warm_model.schedule_shifts(warm_start_from=model)
+        # one hint per staff and hour reaches the solver
+        self.assertEqual(self.num_hints(solve), len(staff_df) * len(demand_df))
+
+        for metric in ('WDC', 'WOR', 'total_cost'):
+            self.assertEqual(warm_results[metric], results[metric])
+
+        # no hints when warm start is disabled
+        with mock.patch('shifts_scheduling.WARM_START', False), \
+                self.spy_solve() as solve:
+            Model(demand_df.copy(), staff_df).schedule_shifts(warm_start_from=model)
+        self.assertEqual(self.num_hints(solve), 0)
+
+        # no hints from a model with different staff
+        other_model = Model(demand_df.copy(), staff_df.assign(staff_id=102))
+        self.assertNotEqual(other_model.cache_key, model.cache_key)
+        with self.spy_solve() as solve:
+            other_model.schedule_shifts(warm_start_from=model)
+        self.assertEqual(self.num_hints(solve), 0)
+
+    def test_min_staff_per_hour(self):
+        '''
+        MIN_STAFF_PER_HOUR bounds the hourly shortfall
+        '''
+
+        staff_df = pd.concat(
+            [self.staff_df.assign(staff_id=s) for s in (101, 102, 103)],
+            ignore_index=True
+        )
+        demand_df = pd.DataFrame(
+            [
+                {
+                    'date_time': pd.to_datetime('2025-01-01') + pd.Timedelta(hours=h),
+                    'demand': d
+                }
+                for h, d in enumerate([0, 1, 3, 5])
+            ]
+        )
+
+        with mock.patch('shifts_scheduling.MIN_STAFF_PER_HOUR', 2):
+            self.assertEqual(Model(demand_df.copy(), staff_df).max_short, [0, 1, 3, 5])
+        with mock.patch('shifts_scheduling.MIN_STAFF_PER_HOUR', 4):
+            self.assertEqual(Model(demand_df.copy(), staff_df).max_short, [0, 1, 1, 3])
+
+        # 2 staff without overtime, 1 day: demand of 2 for the first 9 hours,
+        # then 1. Unbounded, the shifts favour the hours of demand 1,
+        # a bound of 1 staff short forces a staff on every hour of demand 2
+        staff_df = pd.DataFrame(
+            [
+                {
+                    'staff_id': s, 'role': 'Branch Manager',
+                    'hourly_wage': self.wage, 'overtime_hourly_wage': self.ot_wage
+                }
+                for s in (101, 102)
+            ]
+        )
+        demand_df = pd.DataFrame(
+            [
+                {
+                    'date_time': pd.to_datetime('2025-01-01') + pd.Timedelta(hours=h),
+                    'demand': 2 if h < MIN_SHIFT_HOURS else 1
+                }
+                for h in range(24)
+            ]
+        )
+
+        with mock.patch('shifts_scheduling.MIN_STAFF_PER_HOUR', 2):
+            results = Model(demand_df.copy(), staff_df).schedule_shifts()
+        self.assertEqual(results['solver_status'], 'optimal')
+        self.assertEqual(results['WDC'], 0.6667)
+
+        with mock.patch('shifts_scheduling.MIN_STAFF_PER_HOUR', 3):
+            results = Model(demand_df.copy(), staff_df).schedule_shifts()
+        self.assertEqual(results['solver_status'], 'optimal')
+        self.assertEqual(results['WDC'], 0.5625)
+        self.assertIn('2025-01-01 00:00:00',
+                      [shift['start_date_time'] for shift in results['shifts']])
+
+        # a demand below the minimum staff stays a soft shortfall
+        demand_df = pd.DataFrame(
+            [
+                {
+                    'date_time': pd.to_datetime('2025-01-01') + pd.Timedelta(hours=h),
+                    'demand': 1
+                }
+                for h in range(168)
+            ]
+        )
+        with mock.patch('shifts_scheduling.MIN_STAFF_PER_HOUR', 3):
+            results = Model(demand_df, staff_df).schedule_shifts(timeout=10_000)
+        self.assertIsNotNone(results['csv_file'])
+
+    def test_distinct_demands(self):
+        '''
+        many distinct hourly demands keep the objective coefficients in range
+        '''
+
+        demand_df = pd.DataFrame(
+            [
+                {
+                    'date_time': pd.to_datetime('2025-01-01') + pd.Timedelta(hours=h),
+                    'demand': h + 1
+                }
+                for h in range(48)
+            ]
+        )
+
+        results = Model(demand_df, self.staff_df).schedule_shifts()
+        self.assertEqual(results['solver_status'], 'optimal')
+        self.assertEqual(len(results['shifts']), 2)
+
+    def test_mip_gap(self):
+        '''
+        the MIP gap reaches the solver, a negative gap is rejected
+        '''
+
+        demand_df = pd.DataFrame(
+            [
+                {
+                    'date_time': pd.to_datetime('2025-01-01') + pd.Timedelta(hours=h),
+                    'demand': 1
+                }
+                for h in range(24)
+            ]
+        )
+
+        model = Model(demand_df, self.staff_df)
+        with self.assertRaises(ValueError):
+            model.schedule_shifts(mip_gap=-0.01)
+
+        with mock.patch('shifts_scheduling.RELATIVE_MIP_GAP', 0.5):
+            with self.spy_solve() as solve:
+                model.schedule_shifts()
+            solver, _ = solve.call_args[0]
+            self.assertEqual(solver.parameters.relative_gap_limit, 0.5)
+
+            with self.spy_solve() as solve:
+                model.schedule_shifts(mip_gap=0)
+            solver, _ = solve.call_args[0]
+            self.assertEqual(solver.parameters.relative_gap_limit, 0)
+
+    def test_compact_formulation(self):
+        '''
+	    hourly (compact) model gives the same schedules as the pattern model
+        '''
+
+        staff_df = self.staff_df
+        for hours, timeout in ((24, SOLVE_TIME_LIMIT), (168, 10_000)):
+            demand_df = pd.DataFrame(
+                [
+                    {
+                        'date_time': pd.to_datetime('2025-01-01') + pd.Timedelta(hours=h),
+                        'demand': 3
+                    }
+                    for h in range(hours)
+                ]
+            )
+
+            results = Model(demand_df.copy(), staff_df).schedule_shifts(
+                timeout=timeout, formulation='pattern')
+            compact_results = Model(demand_df.copy(), staff_df).schedule_shifts(
+                timeout=timeout, formulation='compact')
+
+            for metric in ('WDC', 'WOR', 'total_cost'):
+                self.assertEqual(compact_results[metric], results[metric])
+            self.assertEqual(len(compact_results['shifts']), len(results['shifts']))
+
+        # several staff, a Branch Manager can't work overtime, shifts over
+        # consecutive days. total_cost differs between alternate optima
+        staff_df = pd.DataFrame(
+            [
+                {
+                    'staff_id': staff_id, 'role': role,
+                    'hourly_wage': self.wage, 'overtime_hourly_wage': self.ot_wage
+                }
+                for staff_id, role in (
+                    (101, 'Branch Manager'),
+                    (201, 'Assistant Branch Manager'),
+                    (301, 'Shift Manager')
+                )
+            ]
+        )
+        demand_df = pd.DataFrame(
+            [
+                {
+                    'date_time': pd.to_datetime('2025-01-01') + pd.Timedelta(hours=h),
+                    'demand': 3 if 8 <= h % 24 < 20 else 1
+                }
+                for h in range(72)
+            ]
+        )
+
+        results = Model(demand_df.copy(), staff_df).schedule_shifts(
+            timeout=SOLVE_TIME_LIMIT, formulation='pattern')
+        compact_results = Model(demand_df.copy(), staff_df).schedule_shifts(
+            timeout=SOLVE_TIME_LIMIT, formulation='compact')
+
+        for r in (results, compact_results):
+            self.assertEqual(r['solver_status'], 'optimal')
+            for shift in r['shifts']:
+                if shift['staff_id'] == '101':
+                    hours = (pd.to_datetime(shift['end_date_time'])
+                             - pd.to_datetime(shift['start_date_time'])) / pd.Timedelta(hours=1)
+                    self.assertEqual(hours, MIN_SHIFT_HOURS)
+        for metric in ('WDC', 'WOR'):
+            self.assertEqual(compact_results[metric], results[metric])